@@ -18,12 +18,26 @@
 from math import *
 import random
 import copy
+import sys
+import hashlib
+import multiprocessing
+from array import array
+from multiprocessing.sharedctypes import RawArray, RawValue
+
+from openingbook import OpeningBook, EncodeMove
 
 STARTING_HLTH = 30
 HAND_CARD_LIMIT = 10
 DECK_SIZE = 30
 STARTING_HAND_SIZE = 3
 MAX_MANA = 10
+OPENING_BOOK_PATH = "openingbook.bin"
+SHARED_TREE_NODES = 1 << 17
+PARALLEL_MIN_MOVES = 4
+LOCK_STRIPES = 64
+VIRTUAL_LOSS = 1
+RANDOM_BATCH = 4096
+TOURNAMENT_SEED = 2
 
 tree = dict()
 
@@ -50,6 +64,65 @@ def pp(self):
             s += str(self[2])
         return s
 
+def DeriveSeed(seed, *keys):
+    """ Derive a 64 bit seed from a tournament seed and job identifiers such as a game number.
+        The same inputs give the same seed in every process.
+    """
+    digest = hashlib.blake2b(repr((seed,) + keys).encode(), digest_size = 8).digest()
+    return int.from_bytes(digest, "little")
+
+class RandomStream:
+    """ A seeded stream of random numbers with its own generator. Numbers are drawn in batches
+        of RANDOM_BATCH so the search indexes a buffer instead of calling the generator every step.
+        It has the choice/random/shuffle/randint methods of the random module, so either can be used.
+    """
+
+    def __init__(self, seed, batch = RANDOM_BATCH):
+        self.seed = seed
+        self.batch = batch
+        self.rng = random.Random(seed)
+        self.Refill()
+
+    def Refill(self):
+        self.buffer = array('I')
+        self.buffer.frombytes(self.rng.getrandbits(32 * self.batch).to_bytes(4 * self.batch, "little"))
+        if sys.byteorder == "big":
+            self.buffer.byteswap()
+        self.pos = 0
+
+    def Derive(self, *keys):
+        """ Return an independent stream for a sub-job of this one.
+        """
+        return RandomStream(DeriveSeed(self.seed, *keys), self.batch)
+
+    def choice(self, seq):
+        if self.pos == self.batch:
+            self.Refill()
+        r = self.buffer[self.pos]
+        self.pos += 1
+        return seq[r % len(seq)]
+
+    def random(self):
+        if self.pos == self.batch:
+            self.Refill()
+        r = self.buffer[self.pos]
+        self.pos += 1
+        return r / 4294967296.0
+
+    def shuffle(self, x):
+        self.rng.shuffle(x)
+
+    def randint(self, a, b):
+        return self.rng.randint(a, b)
+
+def SubStream(rng, *keys):
+    """ Return the independent stream rng.Derive(*keys) for a RandomStream.
+        The random module has no substreams and is returned as it is.
+    """
+    if isinstance(rng, RandomStream):
+        return rng.Derive(*keys)
+    return rng
+
 class Card:
     def __init__(self,cost = 1, atk = 1, hth = 1):
         self.cost = cost
@@ -78,13 +151,45 @@ class Player:
         self.board = []
         self.fatigue_ctr = 1
         self.idf = idf
+        # Aggregates kept up to date by Game.DoMove so GetMoves needn't rescan
+        self.board_atk = 0 # attack of every minion on the board
+        self.ready_atk = 0 # attack of the minions that can still attack
+        self.ready = [] # board indices of the minions that can still attack, in board order
+        self.hand_costs = [0] * (MAX_MANA + 1) # number of cards in hand of each cost
+        self.min_cost = MAX_MANA + 1 # cheapest and dearest card in hand, so a mana total
+        self.max_cost = -1 # tells at once whether none, all or some of the hand is playable
+
+    def AddToHand(self, card):
+        self.hand.append(card)
+        self.hand_costs[card.cost] += 1
+        self.min_cost = min(self.min_cost, card.cost)
+        self.max_cost = max(self.max_cost, card.cost)
+
+    def TakeFromHand(self, idx):
+        card = self.hand.pop(idx)
+        self.hand_costs[card.cost] -= 1
+        if not self.hand_costs[card.cost] and card.cost in (self.min_cost, self.max_cost):
+            costs = [c for c, n in enumerate(self.hand_costs) if n]
+            self.min_cost = costs[0] if costs else MAX_MANA + 1
+            self.max_cost = costs[-1] if costs else -1
+        return card
+
+    def RemoveFromBoard(self, idx):
+        """ Remove the minion at board index idx, keeping the ready indices in step.
+        """
+        minion = self.board.pop(idx)
+        self.board_atk -= minion.atk
+        if not minion.sick:
+            self.ready_atk -= minion.atk
+            self.ready.remove(idx)
+        self.ready = [i - (i > idx) for i in self.ready]
 
     def DrawCard(self):
         if len(self.deck) > 0:
             if len(self.hand) > HAND_CARD_LIMIT:
                 self.deck.pop
             else:
-                self.hand.append(self.deck.pop())
+                self.AddToHand(self.deck.pop())
         else:
             #print("Fatigue!")
             self.hp -= self.fatigue_ctr
@@ -95,15 +200,15 @@ class Player:
 
 class Game:
 
-    def __init__(self,deck1,deck2):
+    def __init__(self,deck1,deck2,rng = random):
         self.player = [Player("Player1",idf=0),Player("Player2",idf=1)]
         #for i in range(2*DECK_SIZE):
         #    a = random.randint(1,MAX_MANA)
         #    b = random.randint(1,MAX_MANA)
         #    c = (a + b) // 2
         #    self.player[i % 2].deck.append(Card(atk = a, hth = b, cost = c))
-        random.shuffle(deck1)
-        random.shuffle(deck2)
+        rng.shuffle(deck1)
+        rng.shuffle(deck2)
         self.player[0].deck = deck1 
         self.player[1].deck = deck2
         self.mana = 1
@@ -116,7 +221,7 @@ class Game:
             self.player[i % 2].DrawCard()
         # Add coin
         coin = Card(cost=0,atk=0,hth=0)
-        self.player[1].hand.append(coin)
+        self.player[1].AddToHand(coin)
         
     def __hash__(self):
         # useful elements
@@ -150,6 +255,8 @@ class Game:
                 self.IncreaseMana()
             for i in self.current_player.board:
                 i.sick = False
+            self.current_player.ready_atk = self.current_player.board_atk
+            self.current_player.ready = list(range(len(self.current_player.board)))
             self.SwitchActivePlayer()
             self.tempmana = self.mana
             self.current_player.DrawCard()
@@ -159,26 +266,32 @@ class Game:
             if move[1].cost is 0:
                 # Coin
                 self.tempmana += 1
-                self.current_player.hand.pop(move[2])
+                self.current_player.TakeFromHand(move[2])
                 return
 
             self.tempmana -= move[1].cost
-            self.current_player.board.append(self.current_player.hand.pop(move[2]))
-            move[1].sick = True
+            card = self.current_player.TakeFromHand(move[2])
+            # move[1] is a copy of the card when the move is replayed on a cloned state
+            card.sick = True
+            self.current_player.board.append(card)
+            self.current_player.board_atk += card.atk
 
         elif move[0] is Movetype.Attack:
             attacker = self.current_player.board[move[1]]
+            if not attacker.sick:
+                self.current_player.ready_atk -= attacker.atk
+                self.current_player.ready.remove(move[1])
             attacker.sick = True
             if move[2] is not -1:
                 defender = self.opp_player.board[move[2]]
 
                 if attacker.hth - defender.atk <= 0:
-                    self.current_player.board.remove(attacker)
+                    self.current_player.RemoveFromBoard(move[1])
                 else:
                     attacker.hth -= defender.atk
 
                 if defender.hth - attacker.atk <= 0:
-                    self.opp_player.board.remove(defender)
+                    self.opp_player.RemoveFromBoard(move[2])
                 else:
                     defender.hth -= attacker.atk
 
@@ -200,47 +313,36 @@ class Game:
         if self.player[0].hp <= 0 or self.player[1].hp <= 0:
             return []
 
-        valid_moves = []
+        me = self.current_player
+        opp = self.opp_player
+        mana = self.tempmana
+
+        if me.max_cost <= mana:
+            valid_moves = [[Movetype.PlayCard,i,idx] for idx,i in enumerate(me.hand)]
+        elif me.min_cost <= mana:
+            valid_moves = [[Movetype.PlayCard,i,idx] for idx,i in enumerate(me.hand) if i.cost <= mana]
+        else:
+            valid_moves = []
+        plays = len(valid_moves)
 
-        for idx,i in enumerate(self.current_player.hand):
-            if i.cost <= self.tempmana:
-                valid_moves.append([Movetype.PlayCard,i,idx])
         # My lethal?
-        my_atk_tot = 0
-        for minion in self.current_player.board:
-            if minion.sick:
-                continue
-            my_atk_tot += minion.atk
-        if self.opp_player.hp < my_atk_tot:
-            for idx,i in enumerate(self.current_player.board):
-                if i.sick:
-                    continue
-                valid_moves.append([Movetype.Attack,idx,-1])
+        if opp.hp < me.ready_atk:
+            valid_moves += [[Movetype.Attack,idx,-1] for idx in me.ready]
             return valid_moves
         
         # Does opp have lethal on board?
-        opp_atk_tot = 0
-        for minion in self.opp_player.board:
-            opp_atk_tot += minion.atk
-        lethal_on_board = False
-        if self.current_player.hp < opp_atk_tot:
-            lethal_on_board = True
-
-        for idx,i in enumerate(self.current_player.board):
-            if i.sick:
-                continue
-            for jdx,j in enumerate(self.opp_player.board):
-                valid_moves.append([Movetype.Attack,idx,jdx])
-            if not lethal_on_board:
-                valid_moves.append([Movetype.Attack,idx,-1])
+        lethal_on_board = me.hp < opp.board_atk
 
-        free_face_hit = True
+        if me.ready:
+            targets = list(range(len(opp.board)))
+            if not lethal_on_board:
+                targets.append(-1)
+            valid_moves += [[Movetype.Attack,idx,jdx] for idx in me.ready for jdx in targets]
 
-        for i in valid_moves:
-            if i[2] != -1:
-                free_face_hit = False
+        # No point ending the turn when the only moves are free hits to the face
+        free_face_hit = plays == 0 and me.ready and not opp.board and not lethal_on_board
 
-        if not free_face_hit or not valid_moves:
+        if not free_face_hit:
             valid_moves.append([Movetype.EndTurn])
 
         return valid_moves
@@ -263,6 +365,17 @@ class Game:
             print("Error!!!")
             return 0.5
 
+    def GetEstimate(self, player_v):
+        """ Get the game result from the viewpoint of player_v, estimated from hit points
+            and board attack if the game is not over yet. Used for truncated rollouts.
+        """
+        if self.player[0].hp <= 0 or self.player[1].hp <= 0:
+            return self.GetResult(player_v)
+        me = self.player[player_v]
+        opp = self.player[1 - player_v]
+        lead = (me.hp - opp.hp) + (me.board_atk - opp.board_atk)
+        return min(1.0, max(0.0, 0.5 + lead / (4.0 * STARTING_HLTH)))
+
     def __repr__(self):
         """ Don't need this - but good style.
         """
@@ -306,12 +419,12 @@ class Node:
         self.hash = hash(state)
         tree[self.hash] = self
         
-    def UCTSelectChild(self):
+    def UCTSelectChild(self, uctk = 1.0):
         """ Use the UCB1 formula to select a child node. Often a constant UCTK is applied so we have
             lambda c: c.wins/c.visits + UCTK * sqrt(2*log(self.visits)/c.visits to vary the amount of
             exploration versus exploitation.
         """
-        s = max(self.childNodes, key = lambda c: c.wins/c.visits + sqrt(2*log(self.visits)/c.visits))
+        s = max(self.childNodes, key = lambda c: c.wins/c.visits + uctk * sqrt(2*log(self.visits)/c.visits))
         return s
     
     def AddChild(self, m, s):
@@ -367,14 +480,48 @@ class Node:
         return s
 
 
-def UCT(rootstate, itermax, verbose = False):
+def RandomRollout(state, moves, rng):
+    """ Pick a uniformly random move.
+    """
+    return rng.choice(moves)
+
+def GreedyRollout(state, moves, rng):
+    """ Play the most expensive card we can, otherwise pick a random move.
+    """
+    best = None
+    for m in moves:
+        if m[0] is Movetype.PlayCard and (best is None or m[1].cost > best[1].cost):
+            best = m
+    return best or rng.choice(moves)
+
+ROLLOUT_POLICIES = {"random": RandomRollout, "greedy": GreedyRollout}
+
+def UCTSearch(rootstate, itermax, priors = None, uctk = 1.0, rollout = "random", maxrollout = None, rng = random):
     """ Conduct a UCT search for itermax iterations starting from rootstate.
-        Return the best move from the rootstate.
+        Return the root node so callers can inspect the child statistics.
+        priors is an optional list of [move, visits, wins] preloaded into the root's children;
+        the ones actually seeded are kept in rootnode.priors.
+        uctk scales the exploration term, rollout names one of ROLLOUT_POLICIES and maxrollout
+        truncates rollouts after that many moves, scoring them with GetEstimate.
+        Expansion and rollouts draw from rng, which may be a RandomStream or the random module.
         Assumes 2 alternating players (player 1 starts), with game results in the range [0.0, 1.0]."""
 
     tree.clear()
     # TODO slide to the next position keeping the using tree benefiting from the subtree playouts.
     rootnode = Node(state = rootstate)
+    rootnode.priors = []
+
+    for m, visits, wins in priors or []:
+        if visits <= 0:
+            continue
+        state = rootstate.Clone()
+        state.DoMove(m)
+        child = rootnode.AddChild(m, state)
+        if child is not None:
+            child.visits = visits
+            child.wins = wins
+            rootnode.visits += visits
+            rootnode.priors.append([m, visits, wins])
 
     for i in range(itermax):
         #print(i)
@@ -384,21 +531,26 @@ def UCT(rootstate, itermax, verbose = False):
         # Select
         #print("Select")
         while node.untriedMoves == [] and node.childNodes != []: # node is fully expanded and non-terminal
-            node = node.UCTSelectChild()
+            node = node.UCTSelectChild(uctk)
             state.DoMove(node.move)
 
         # Expand
         #print("Expand")
         if node.untriedMoves != [] and node is not None: # if we can expand (i.e. state/node is non-terminal)
-            m = random.choice(node.untriedMoves) 
+            m = rng.choice(node.untriedMoves)
             state.DoMove(m)
             node = node.AddChild(m,state) # add child and descend tree
 
         #print("Rollout")
         # Rollout - this can often be made orders of magnitude quicker using a state.GetRandomMove() function
         # TODO make the opponent's hand unknown so that we can represent the imperfect information.
-        while state.GetMoves() != []: # while state is non-terminal
-            state.DoMove(random.choice(state.GetMoves()))
+        policy = ROLLOUT_POLICIES[rollout]
+        depth = 0
+        moves = state.GetMoves()
+        while moves != [] and depth != maxrollout: # while state is non-terminal
+            state.DoMove(policy(state, moves, rng))
+            moves = state.GetMoves()
+            depth += 1
 
         #print(state)
 
@@ -406,9 +558,61 @@ def UCT(rootstate, itermax, verbose = False):
         #print("Backpropagate")
         while node != None: # backpropagate from the expanded node and work back to the root node
             #print (node.playerJustMoved)
-            node.Update(state.GetResult(node.playerJustMoved)) # state is terminal. Update node with result from POV of node.playerJustMoved
+            node.Update(state.GetEstimate(node.playerJustMoved)) # state is terminal unless truncated. Update node with result from POV of node.playerJustMoved
             node = node.parentNode
 
+    return rootnode
+
+def BookProbe(book, rootstate, moves, itermax):
+    """ Consult the opening book before a search from rootstate.
+        Return (move, priors): move is the book move if the position needs no search, otherwise
+        None, and priors is a list of [move, visits, wins] to seed the root with. Moves are taken from moves.
+    """
+    priors = []
+    if book is None or not book.Covers(rootstate):
+        return None, priors
+    entries = book.Lookup(rootstate, moves)
+    if entries and sum(e[1] for e in entries) >= book.Threshold(itermax):
+        m = max(entries, key = lambda e: e[1])[0]
+        if PRINTS:
+            print ("Book move: " + pp(m))
+        return m, priors
+    if entries and book.seedpriors:
+        scale = min(1.0, book.priorvisits / sum(e[1] for e in entries))
+        for m, visits, wins in entries:
+            # Priors too small to count as a visit are dropped, as a child can't hold wins without visits
+            if int(visits * scale) > 0:
+                priors.append([m, int(visits * scale), wins * scale])
+    return None, priors
+
+def BookRecord(book, rootstate, entries, priors):
+    """ Add the root statistics of a search, a list of [move, visits, wins], to the opening book.
+        Only what this search found is stored, not the priors it was actually seeded with.
+        Priors are matched to moves by book move code, each subtracted once; the book adds
+        up moves with the same code, so it does not matter which copy of a card it comes off.
+    """
+    if book is None or not book.Covers(rootstate):
+        return
+    seeded = dict((EncodeMove(p[0]), p) for p in priors)
+    found = []
+    for m, visits, wins in entries:
+        p = seeded.pop(EncodeMove(m), [m, 0, 0.0])
+        found.append([m, visits - p[1], wins - p[2]])
+    book.Record(rootstate, found)
+
+def UCT(rootstate, itermax, verbose = False, book = None, uctk = 1.0, rollout = "random", maxrollout = None, rng = random):
+    """ Conduct a UCT search for itermax iterations starting from rootstate.
+        Return the best move from the rootstate.
+        If an OpeningBook is given it is consulted before searching and updated afterwards.
+        The remaining settings are passed on to UCTSearch.
+    """
+    m, priors = BookProbe(book, rootstate, rootstate.GetMoves(), itermax)
+    if m is not None:
+        return m
+
+    rootnode = UCTSearch(rootstate, itermax, priors, uctk, rollout, maxrollout, rng)
+    BookRecord(book, rootstate, [[c.move, c.visits, c.wins] for c in rootnode.childNodes], rootnode.priors)
+
     # Output some information about the tree - can be omitted
     if PRINTS:
         if (verbose): print (rootnode.TreeToString(0))
@@ -416,19 +620,221 @@ def UCT(rootstate, itermax, verbose = False):
 
     return max(rootnode.childNodes, key = lambda c: c.visits).move # return the move that was most visited
                 
-def UCTPlayGame(d1,d2):
+class SharedTree:
+    """ A search tree held in shared memory so several processes can grow and search it together.
+        Nodes are indices into flat arrays. The children of node i are the contiguous block
+        first[i] .. first[i] + count[i] - 1 and child k is reached by move k of the parent's GetMoves().
+        Updates to a node are made under one of a fixed set of striped locks.
+    """
+
+    def __init__(self, size = SHARED_TREE_NODES, stripes = LOCK_STRIPES):
+        self.size = size
+        self.visits = RawArray('i', size)
+        self.vloss = RawArray('i', size) # virtual losses of searches currently passing through
+        self.wins = RawArray('d', size)
+        self.first = RawArray('i', size) # -1 while the node is unexpanded
+        self.count = RawArray('i', size)
+        self.move = RawArray('i', size)
+        self.endturn = RawArray('b', size)
+        self.used = RawValue('i', 1)
+        self.alloc = multiprocessing.Lock()
+        self.locks = [multiprocessing.Lock() for i in range(stripes)]
+        self.first[0] = -1
+
+    def Lock(self, node):
+        return self.locks[node % len(self.locks)]
+
+    def Expand(self, node, moves):
+        """ Allocate a child for every move unless another process got there first.
+            Return False if the tree is full.
+        """
+        with self.Lock(node):
+            if self.first[node] >= 0:
+                return True
+            with self.alloc:
+                base = self.used.value
+                if base + len(moves) > self.size:
+                    return False
+                self.used.value = base + len(moves)
+            for k, m in enumerate(moves):
+                c = base + k
+                self.first[c] = -1
+                self.move[c] = k
+                self.endturn[c] = m[0] == Movetype.EndTurn
+            self.count[node] = len(moves)
+            # Publish last so other processes never see a partly built block
+            self.first[node] = base
+            return True
+
+    def SelectChild(self, node, rng):
+        """ Use the UCB1 formula to select a child, counting virtual losses as visits without wins
+            so that concurrent searches spread over different branches. Unvisited children go first.
+        """
+        first = self.first[node]
+        logn = log(max(1, self.visits[node] + self.vloss[node]))
+        best = first
+        bestscore = -1.0
+        for c in range(first, first + self.count[node]):
+            n = self.visits[c] + self.vloss[c]
+            if n == 0:
+                score = 1e9 + rng.random()
+            else:
+                score = self.wins[c]/n + sqrt(2*logn/n)
+            if score > bestscore:
+                best, bestscore = c, score
+        return best
+
+    def AddVirtualLoss(self, node):
+        with self.Lock(node):
+            self.vloss[node] += VIRTUAL_LOSS
+
+    def Update(self, node, result):
+        with self.Lock(node):
+            self.vloss[node] -= VIRTUAL_LOSS
+            self.visits[node] += 1
+            self.wins[node] += result
+
+    def NodeToString(self, node, move):
+        return "[M:" + str(move) + " W/V:" + str(self.wins[node]) + "/" + str(self.visits[node]) + "]"
+
+    def TreeToString(self, state, node = 0, move = None, indent = 0):
+        """ Like Node.TreeToString, replaying the moves from state to name each child.
+        """
+        s = "\n" + "| " * indent + self.NodeToString(node, move)
+        if self.first[node] >= 0:
+            moves = state.GetMoves()
+            for c in range(self.first[node], self.first[node] + self.count[node]):
+                child = state.Clone()
+                child.DoMove(moves[self.move[c]])
+                s += self.TreeToString(child, c, moves[self.move[c]], indent + 1)
+        return s
+
+    def ChildrenToString(self, rootstate):
+        s = ""
+        moves = rootstate.GetMoves()
+        for c in range(self.first[0], self.first[0] + self.count[0]):
+            s += self.NodeToString(c, moves[self.move[c]]) + "\n"
+        return s
+
+def TreeParallelWorker(stree, rootstate, itermax, rng):
+    """ Run itermax iterations of UCT on the shared tree, drawing random numbers from rng.
+        The tree never goes past an END TURN, so every node is scored from the viewpoint
+        of the player to move at the root.
+    """
+    player = rootstate.current_player.idf
+
+    for i in range(itermax):
+        node = 0
+        state = rootstate.Clone()
+        path = [node]
+        stree.AddVirtualLoss(node)
+
+        # Select and expand
+        while not stree.endturn[node]:
+            moves = state.GetMoves()
+            if moves == []:
+                break
+            if stree.first[node] < 0:
+                # Roll out from a new node once before expanding it
+                if node != 0 and stree.visits[node] == 0:
+                    break
+                if not stree.Expand(node, moves):
+                    break
+            node = stree.SelectChild(node, rng)
+            stree.AddVirtualLoss(node)
+            path.append(node)
+            state.DoMove(moves[stree.move[node]])
+
+        # Rollout
+        moves = state.GetMoves()
+        while moves != []:
+            state.DoMove(rng.choice(moves))
+            moves = state.GetMoves()
+
+        # Backpropagate
+        result = state.GetResult(player)
+        for node in path:
+            stree.Update(node, result)
+
+def TreeParallelUCT(rootstate, itermax, workers = None, verbose = False, book = None, rng = None):
+    """ Conduct a UCT search for itermax iterations in total, shared between worker processes
+        that all search one tree in shared memory. Return the best move from the rootstate.
+        The opening book is used as in UCT, seeding the shared root with its priors.
+        Each worker gets its own stream derived from rng. The workers race for the tree, so
+        unlike UCT the result also depends on timing.
+    """
+    moves = rootstate.GetMoves()
+    if moves == []:
+        raise ValueError("No legal moves to search from")
+    m, priors = BookProbe(book, rootstate, moves, itermax)
+    if m is not None:
+        return m
+
+    workers = workers or multiprocessing.cpu_count()
+    if not isinstance(rng, RandomStream):
+        rng = RandomStream((rng or random).getrandbits(64))
+    stree = SharedTree()
+    stree.Expand(0, moves)
+    # The first move with each code, the one the book statistics belong to
+    index = {}
+    for k, mv in enumerate(moves):
+        index.setdefault(EncodeMove(mv), k)
+    for m, visits, wins in priors:
+        c = stree.first[0] + index[EncodeMove(m)]
+        stree.visits[c] = visits
+        stree.wins[c] = wins
+        stree.visits[0] += visits
+    streams = [rng.Derive("worker", w) for w in range(workers)]
+    if workers == 1:
+        TreeParallelWorker(stree, rootstate, itermax, streams[0])
+    else:
+        procs = []
+        for w in range(workers):
+            share = itermax // workers + (w < itermax % workers)
+            p = multiprocessing.Process(target = TreeParallelWorker, args = (stree, rootstate, share, streams[w]))
+            p.start()
+            procs.append(p)
+        for p in procs:
+            p.join()
+        failed = [p.exitcode for p in procs if p.exitcode != 0]
+        if failed:
+            raise RuntimeError(str(len(failed)) + " of " + str(workers) + " tree-parallel workers failed, exit codes " + str(failed))
+
+    first = stree.first[0]
+    children = range(first, first + stree.count[0])
+    BookRecord(book, rootstate, [[moves[stree.move[c]], stree.visits[c], stree.wins[c]] for c in children], priors)
+
+    if PRINTS:
+        if (verbose): print (stree.TreeToString(rootstate))
+        else: print (stree.ChildrenToString(rootstate))
+
+    best = max(children, key = lambda c: stree.visits[c])
+    return moves[stree.move[best]] # return the move that was most visited
+
+def UCTPlayGame(d1,d2,book = None,workers = 1,rng = random):
     """ Play a sample game between two UCT players where each player gets a different number 
-        of UCT iterations (= simulations = tree nodes).
+        of UCT iterations (= simulations = tree nodes). Both players share the optional opening book.
+        With more than one worker, decisions with at least PARALLEL_MIN_MOVES legal moves, i.e. the
+        widest and so hardest trees, use a tree-parallel search over all workers instead.
+        The deck shuffle and every search draw from their own substream of rng, so a search's
+        result does not depend on how much randomness earlier searches used. With workers > 1
+        the game is not reproducible, since tree-parallel results depend on worker timing.
     """
-    state = Game(d1,d2)
+    state = Game(d1,d2,SubStream(rng, "shuffle"))
+    move = 0
 
     while (state.player[0].hp > 0 and state.player[1].hp > 0):
         if PRINTS:
             print (str(state))
-        m = UCT(rootstate = state, itermax = 1000, verbose = True) # play with values for itermax and verbose = True
+        search_rng = SubStream(rng, "move", move)
+        if workers > 1 and len(state.GetMoves()) >= PARALLEL_MIN_MOVES:
+            m = TreeParallelUCT(rootstate = state, itermax = 1000, workers = workers, verbose = True, book = book, rng = search_rng)
+        else:
+            m = UCT(rootstate = state, itermax = 1000, verbose = True, book = book, rng = search_rng) # play with values for itermax and verbose = True
         if PRINTS:
             print ("Best Move: " + pp(m) + "\n")
         state.DoMove(m)
+        move += 1
         # Attempt to hold tree from node that we moved to.
 
     if state.GetResult(state.current_player.idf) == 1.0:
@@ -444,21 +850,29 @@ def UCTPlayGame(d1,d2):
     if PRINTS:
         print (str(state))
 
-if __name__ == "__main__":
-    """ Play a single game to the end using UCT for both players. 
+def MakeDecks(count = 10, rng = random):
+    """ Make count random decks of DECK_SIZE cards drawing from rng.
     """
-    random.seed(2)
-    # make 10 decks
-
     decks = []
-    for i in range(0,10):
+    for i in range(0,count):
         d = []
-        for j in range(0,30):
-            a = random.randint(1,MAX_MANA)
-            b = random.randint(1,MAX_MANA)
+        for j in range(0,DECK_SIZE):
+            a = rng.randint(1,MAX_MANA)
+            b = rng.randint(1,MAX_MANA)
             c = (a + b) // 2
             d.append(Card(atk = a, hth = b, cost = c))
         decks.append(d)
+    return decks
+
+if __name__ == "__main__":
+    """ Play a single game to the end using UCT for both players. 
+        An optional argument gives the number of worker processes for tree-parallel search.
+    """
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+    # make 10 decks
+
+    decks = MakeDecks(10, random.Random(TOURNAMENT_SEED))
+    book = OpeningBook(OPENING_BOOK_PATH)
 
     winner = [0] * 10
 
@@ -471,13 +885,16 @@ if __name__ == "__main__":
         print(j)
         if (i/10) is (i%10):
             continue
-        w = UCTPlayGame(copy.deepcopy(decks[i // 10]), copy.deepcopy(decks[i % 10]))
+        rng = RandomStream(DeriveSeed(TOURNAMENT_SEED, j))
+        w = UCTPlayGame(copy.deepcopy(decks[i // 10]), copy.deepcopy(decks[i % 10]), book, workers, rng = rng)
         #print(Node.counter)
         if w == 0:
             winner[i//10] += 1
         else:
             winner[i%10] += 1
 
+    book.Close()
+
     for idx,d in enumerate(decks):
         print(sorted(d))
         print(winner[idx])
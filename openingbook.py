@@ -0,0 +1,208 @@
+# A persistent opening book for the early turns of the game.
+#
+# Positions are keyed by a canonical encoding of the visible early-game state (mana,
+# hit points, the current player's hand card stats including the coin, both boards and
+# the size of the opponent's hand). For every key the book stores the aggregated root
+# child statistics of previous UCT searches from that position.
+#
+# The book is a single fixed-size file that is memory mapped. It is laid out as a
+# set-associative table: a key hashes to a bucket of BOOK_WAYS records and when the
+# bucket is full the least recently used record in it is evicted. The file never grows
+# past the capacity it was created with. Only one process should write to a book at
+# a time.
+
+import os
+import mmap
+import struct
+import hashlib
+
+BOOK_MAGIC = b"HSOB"
+BOOK_VERSION = 1
+BOOK_MAX_MANA = 3
+BOOK_WAYS = 8
+BOOK_MOVE_SLOTS = 12
+BOOK_MAX_VISITS = 1 << 30
+# Searches aggregated into a position before its book move is played without searching
+BOOK_SEARCHES = 4
+
+# magic, version, capacity, clock
+HEADER = struct.Struct("<4sIIQ")
+# key, last used, total visits, then (move code, visits, wins) per slot
+RECORD = struct.Struct("<QQI" + "IIf" * BOOK_MOVE_SLOTS)
+
+# Same values as Movetype in the game scripts, repeated so the book works with either.
+END_TURN = 1
+PLAY_CARD = 2
+ATTACK = 3
+
+def EncodeState(state):
+    """ Return the canonical byte encoding of the visible part of state.
+        Hand order is irrelevant so the hand is sorted, board order is kept because
+        attack moves refer to board positions.
+    """
+    me = state.current_player
+    opp = state.opp_player
+    hand = sorted((c.cost, c.atk, c.hth) for c in me.hand)
+    values = [me.idf, state.mana, state.tempmana, me.hp, opp.hp, len(opp.hand), len(hand)]
+    for c in hand:
+        values.extend(c)
+    values.append(len(me.board))
+    for c in me.board:
+        values.extend((c.atk, c.hth, c.sick))
+    values.append(len(opp.board))
+    for c in opp.board:
+        values.extend((c.atk, c.hth))
+    return struct.pack("<%dh" % len(values), *values)
+
+def StateKey(state):
+    """ Return the 64 bit book key for state. Zero marks an empty record so is never used.
+    """
+    digest = hashlib.blake2b(EncodeState(state), digest_size = 8).digest()
+    return struct.unpack("<Q", digest)[0] or 1
+
+def EncodeMove(move):
+    """ Return a move as a 32 bit code independent of the hand order.
+        Cards are identified by their stats, attacks by board positions.
+    """
+    if move[0] == END_TURN:
+        return END_TURN << 24
+    elif move[0] == PLAY_CARD:
+        c = move[1]
+        return (PLAY_CARD << 24) | (c.cost << 16) | (c.atk << 8) | c.hth
+    else:
+        return (ATTACK << 24) | (move[1] << 8) | (move[2] + 1)
+
+class OpeningBook:
+    """ Aggregated root statistics for early-game positions, stored in a memory mapped file.
+    """
+
+    def __init__(self, path, capacity = 1 << 16, minvisits = 0, seedpriors = True, priorvisits = 100):
+        """ Open the book at path, creating it with room for capacity positions if missing.
+            An existing book keeps the capacity it was created with.
+            A book move is played without searching when the position has at least
+            minvisits visits (0 means BOOK_SEARCHES times as many as one search does).
+            Until then every search from the position is added to the book.
+            When seedpriors is set, the stored statistics are scaled down to priorvisits
+            visits in total and preloaded into the root of the search instead.
+        """
+        self.minvisits = minvisits
+        self.seedpriors = seedpriors
+        self.priorvisits = priorvisits
+        capacity = max(BOOK_WAYS, capacity - capacity % BOOK_WAYS)
+        if not os.path.exists(path):
+            with open(path, "wb") as f:
+                f.write(HEADER.pack(BOOK_MAGIC, BOOK_VERSION, capacity, 0))
+                f.truncate(HEADER.size + capacity * RECORD.size)
+        self.file = open(path, "r+b")
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        magic, version, self.capacity, self.clock = HEADER.unpack_from(self.map, 0)
+        if magic != BOOK_MAGIC or version != BOOK_VERSION:
+            self.Close()
+            raise ValueError("Not an opening book: " + str(path))
+        if len(self.map) != HEADER.size + self.capacity * RECORD.size:
+            self.Close()
+            raise ValueError("Truncated opening book: " + str(path))
+
+    def Threshold(self, itermax):
+        """ The number of stored visits at which a position is played from the book.
+        """
+        return self.minvisits or BOOK_SEARCHES * itermax
+
+    def Covers(self, state):
+        """ Whether state is early enough in the game to be kept in the book.
+        """
+        return state.mana <= BOOK_MAX_MANA
+
+    def Find(self, key):
+        """ Return the offset of the record for key, or None if it is not in the book.
+        """
+        bucket = (key % (self.capacity // BOOK_WAYS)) * BOOK_WAYS
+        for i in range(bucket, bucket + BOOK_WAYS):
+            offset = HEADER.size + i * RECORD.size
+            if struct.unpack_from("<Q", self.map, offset)[0] == key:
+                return offset
+        return None
+
+    def Claim(self, key):
+        """ Return the offset of a record for key, evicting the least recently used
+            record of its bucket if there is no room.
+        """
+        bucket = (key % (self.capacity // BOOK_WAYS)) * BOOK_WAYS
+        victim = None
+        oldest = None
+        for i in range(bucket, bucket + BOOK_WAYS):
+            offset = HEADER.size + i * RECORD.size
+            k, used = struct.unpack_from("<QQ", self.map, offset)
+            if k == key or k == 0:
+                return offset
+            if oldest is None or used < oldest:
+                victim, oldest = offset, used
+        return victim
+
+    def Tick(self):
+        self.clock += 1
+        HEADER.pack_into(self.map, 0, BOOK_MAGIC, BOOK_VERSION, self.capacity, self.clock)
+        return self.clock
+
+    def Lookup(self, state, moves):
+        """ Return the stored statistics for state as a list of [move, visits, wins],
+            where each move is taken from moves. Return [] if the position is unknown.
+        """
+        if not self.Covers(state):
+            return []
+        offset = self.Find(StateKey(state))
+        if offset is None:
+            return []
+        fields = RECORD.unpack_from(self.map, offset)
+        stats = {}
+        for i in range(3, len(fields), 3):
+            if fields[i]:
+                stats[fields[i]] = fields[i + 1:i + 3]
+        entries = []
+        for m in moves:
+            code = EncodeMove(m)
+            if code in stats:
+                # Two copies of the same card share the statistics only once
+                visits, wins = stats.pop(code)
+                entries.append([m, visits, wins])
+        fields = list(fields)
+        fields[1] = self.Tick()
+        RECORD.pack_into(self.map, offset, *fields)
+        return entries
+
+    def Record(self, state, entries):
+        """ Add the root statistics in entries, a list of [move, visits, wins], to the book.
+        """
+        if not self.Covers(state) or not entries:
+            return
+        key = StateKey(state)
+        offset = self.Claim(key)
+        fields = RECORD.unpack_from(self.map, offset)
+        stats = {}
+        if fields[0] == key:
+            for i in range(3, len(fields), 3):
+                if fields[i]:
+                    stats[fields[i]] = list(fields[i + 1:i + 3])
+        for m, visits, wins in entries:
+            s = stats.setdefault(EncodeMove(m), [0, 0.0])
+            s[0] += visits
+            s[1] += wins
+        best = sorted(stats.items(), key = lambda s: -s[1][0])[:BOOK_MOVE_SLOTS]
+        total = sum(s[0] for code, s in best)
+        while total > BOOK_MAX_VISITS:
+            for code, s in best:
+                s[0] //= 2
+                s[1] /= 2
+            total = sum(s[0] for code, s in best)
+        fields = [key, self.Tick(), total]
+        for code, (visits, wins) in best:
+            fields.extend((code, visits, wins))
+        fields.extend([0, 0, 0.0] * (BOOK_MOVE_SLOTS - len(best)))
+        RECORD.pack_into(self.map, offset, *fields)
+
+    def Flush(self):
+        self.map.flush()
+
+    def Close(self):
+        self.map.close()
+        self.file.close()
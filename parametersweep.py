@@ -0,0 +1,205 @@
+# A sweep harness for the UCT search settings.
+#
+# Every candidate configuration plays a match against a reference configuration on the
+# seeded decks from decktournement.py. Each deck pairing is played twice with the seats
+# swapped. Games are spread over a process pool. For each match the candidate's win rate
+# (with a Wilson confidence interval) is recorded next to its cost: CPU seconds and tree
+# nodes per move. Results are appended to a JSON lines file, and matches already in the
+# file are reused instead of being replayed. The report names the cheapest configuration
+# whose confidence interval does not lie wholly below the target win rate.
+#
+# Usage:
+#   python parametersweep.py results.jsonl [games] [workers] [target]
+
+import sys
+import json
+import time
+import copy
+import random
+import multiprocessing
+from math import sqrt
+
+import decktournement
+from decktournement import Game, Node, MakeDecks, UCT, RandomStream, DeriveSeed, SubStream
+
+# A configuration is a dict of these settings
+DEFAULT_CONFIG = {"itermax": 1000, "uctk": 1.0, "rollout": "random", "maxrollout": None}
+
+DEFAULT_SWEEP = [
+    {"itermax": 250},
+    {"itermax": 500},
+    {"itermax": 500, "uctk": 0.5},
+    {"itermax": 500, "uctk": 2.0},
+    {"itermax": 500, "rollout": "greedy"},
+    {"itermax": 500, "maxrollout": 20},
+    {"itermax": 1000, "maxrollout": 20},
+]
+
+# Bump whenever the games behind a MatchKey change, so older cached results are not reused
+SWEEP_FORMAT = 3
+DECK_SEED = 2
+DECK_COUNT = 10
+Z_95 = 1.96
+
+def Config(settings):
+    """ Return a complete configuration from the settings that differ from DEFAULT_CONFIG.
+    """
+    c = dict(DEFAULT_CONFIG)
+    c.update(settings)
+    return c
+
+def MatchKey(candidate, reference, games, seed):
+    """ Return the cache key of a match.
+    """
+    return json.dumps([SWEEP_FORMAT, candidate, reference, games, seed, DECK_SEED, DECK_COUNT], sort_keys = True)
+
+def Wilson(wins, games, z = Z_95):
+    """ Return the Wilson score interval for a win rate of wins out of games.
+    """
+    if games == 0:
+        return [0.0, 1.0]
+    p = wins / games
+    centre = (p + z*z/(2*games)) / (1 + z*z/games)
+    half = z * sqrt(p*(1-p)/games + z*z/(4*games*games)) / (1 + z*z/games)
+    return [max(0.0, centre - half), min(1.0, centre + half)]
+
+def PlaySweepGame(job):
+    """ Play one game where player i searches with configs[i].
+        Return the winning player (None for a draw) and CPU seconds, nodes and moves per player.
+    """
+    configs, d1, d2, seed = job
+    decktournement.PRINTS = False
+    rng = RandomStream(seed)
+    state = Game(copy.deepcopy(d1), copy.deepcopy(d2), SubStream(rng, "shuffle"))
+    cpu = [0.0, 0.0]
+    nodes = [0, 0]
+    moves = [0, 0]
+
+    while (state.player[0].hp > 0 and state.player[1].hp > 0):
+        p = state.current_player.idf
+        c = configs[p]
+        counter = Node.counter
+        start = time.process_time()
+        m = UCT(state, c["itermax"], uctk = c["uctk"], rollout = c["rollout"], maxrollout = c["maxrollout"], rng = SubStream(rng, "move", sum(moves)))
+        cpu[p] += time.process_time() - start
+        nodes[p] += Node.counter - counter
+        moves[p] += 1
+        state.DoMove(m)
+
+    winner = None
+    if state.player[0].hp > 0:
+        winner = 0
+    elif state.player[1].hp > 0:
+        winner = 1
+    return winner, cpu, nodes, moves
+
+def PlayMatch(candidate, reference, games, seed, pool):
+    """ Play games between candidate and reference and return the match record.
+    """
+    # The decks depend only on DECK_SEED, as recorded in MatchKey, the pairings on the match seed
+    decks = MakeDecks(DECK_COUNT, random.Random(DECK_SEED))
+    pairings = random.Random(DeriveSeed(seed, "pairings"))
+    jobs = []
+    for g in range(games):
+        # Odd games replay the previous pairing with the seats swapped
+        if g % 2 == 0:
+            i, j = pairings.sample(range(DECK_COUNT), 2)
+            configs = (candidate, reference)
+        else:
+            configs = (reference, candidate)
+        jobs.append((configs, decks[i], decks[j], DeriveSeed(seed, "game", g)))
+
+    score = 0.0
+    draws = 0
+    cpu = [0.0, 0.0]
+    nodes = [0, 0]
+    moves = [0, 0]
+    for g, (winner, c, n, m) in enumerate(pool.imap(PlaySweepGame, jobs)):
+        # Index 0 of the totals is the candidate, 1 the reference
+        seat = g % 2
+        if winner is None:
+            draws += 1
+            score += 0.5
+        elif winner == seat:
+            score += 1
+        for k in range(2):
+            side = (k + seat) % 2
+            cpu[side] += c[k]
+            nodes[side] += n[k]
+            moves[side] += m[k]
+
+    return {"key": MatchKey(candidate, reference, games, seed),
+            "candidate": candidate, "reference": reference, "games": games, "seed": seed,
+            "score": score, "draws": draws,
+            "winrate": score / games, "ci": Wilson(score, games),
+            "cpu_per_move": cpu[0] / max(1, moves[0]), "nodes_per_move": nodes[0] / max(1, moves[0]),
+            "ref_cpu_per_move": cpu[1] / max(1, moves[1]), "ref_nodes_per_move": nodes[1] / max(1, moves[1])}
+
+def LoadResults(path):
+    """ Return the match records in the results file at path, keyed by MatchKey.
+    """
+    results = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                results[record["key"]] = record
+    except FileNotFoundError:
+        pass
+    return results
+
+def Sweep(path, candidates = DEFAULT_SWEEP, reference = None, games = 20, workers = None, seed = 0):
+    """ Play every candidate against reference, reusing matches already in the results file
+        at path and appending new ones. Return the records in the order of candidates.
+    """
+    reference = Config(reference or {})
+    results = LoadResults(path)
+    records = []
+    with multiprocessing.Pool(workers or multiprocessing.cpu_count()) as pool:
+        for settings in candidates:
+            candidate = Config(settings)
+            key = MatchKey(candidate, reference, games, seed)
+            if key not in results:
+                results[key] = PlayMatch(candidate, reference, games, seed, pool)
+                with open(path, "a") as f:
+                    f.write(json.dumps(results[key]) + "\n")
+            records.append(results[key])
+    return records
+
+def Cheapest(records, target):
+    """ Return the record with the lowest CPU time per move that is not shown to be weaker
+        than target, or None if every configuration is. This is a non-inferiority check:
+        a configuration passes when the upper end of its win rate's confidence interval
+        reaches target.
+    """
+    strong = [r for r in records if r["ci"][1] >= target]
+    if not strong:
+        return None
+    return min(strong, key = lambda r: r["cpu_per_move"])
+
+def Report(records, target):
+    s = ""
+    for r in sorted(records, key = lambda r: r["cpu_per_move"]):
+        s += "%-70s win %.2f [%.2f, %.2f]  cpu/move %.4fs  nodes/move %.0f\n" % (
+            json.dumps(r["candidate"], sort_keys = True), r["winrate"], r["ci"][0], r["ci"][1],
+            r["cpu_per_move"], r["nodes_per_move"])
+    best = Cheapest(records, target)
+    if best is None:
+        s += "Every configuration is shown to win less than " + str(target) + "\n"
+    else:
+        s += "Cheapest configuration not shown to win less than " + str(target) + ": "
+        s += json.dumps(best["candidate"], sort_keys = True) + " win %.2f [%.2f, %.2f]\n" % (
+            best["winrate"], best["ci"][0], best["ci"][1])
+    return s
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("usage: parametersweep.py results.jsonl [games] [workers] [target]")
+        sys.exit(1)
+    games = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else None
+    target = float(sys.argv[4]) if len(sys.argv) > 4 else 0.45
+    print(Report(Sweep(sys.argv[1], games = games, workers = workers), target))
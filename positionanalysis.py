@@ -0,0 +1,166 @@
+# Batch analysis of many Game positions with UCT.
+#
+# Positions are read from a file of pickled Game objects (one pickle.dump per position)
+# and analysed in parallel across cores. For each position the root child statistics
+# and the best move are written as one JSON line to the output file. Input and output
+# are streamed in batches so huge position sets never have to fit in memory, and
+# positions already present in the output file are skipped on rerun. An output file only
+# ever holds results for one itermax and seed.
+#
+# Usage:
+#   python positionanalysis.py generate positions.pkl [count] [seed]
+#   python positionanalysis.py analyse positions.pkl results.jsonl [itermax] [workers]
+
+import sys
+import json
+import pickle
+import random
+import copy
+import itertools
+import multiprocessing
+
+import decktournement
+from decktournement import Game, MakeDecks, UCTSearch, RandomStream, DeriveSeed, SubStream, pp
+
+BATCH_PER_WORKER = 8
+
+def ReadPositions(path):
+    """ Yield (position id, Game) pairs from a file of pickled Game objects.
+        The position id is the index of the position in the file.
+    """
+    with open(path, "rb") as f:
+        pid = 0
+        while True:
+            try:
+                state = pickle.load(f)
+            except EOFError:
+                return
+            yield pid, state
+            pid += 1
+
+def WritePositions(path, positions):
+    """ Write the Game objects in positions to a new file at path.
+        Refuses to touch an existing file so position ids never shift or repeat.
+    """
+    with open(path, "xb") as f:
+        for state in positions:
+            pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+
+def SamplePositions(count, seed = 2, decks = 10):
+    """ Yield count positions taken from games between seeded random decks.
+        Each game is played with random moves and every position along the way is kept.
+    """
+    deck_list = MakeDecks(decks, random.Random(seed))
+    pairings = random.Random(DeriveSeed(seed, "pairings"))
+    produced = 0
+    game = 0
+    while produced < count:
+        d1, d2 = pairings.sample(range(decks), 2)
+        rng = RandomStream(DeriveSeed(seed, "game", game))
+        state = Game(copy.deepcopy(deck_list[d1]), copy.deepcopy(deck_list[d2]), SubStream(rng, "shuffle"))
+        game += 1
+        moves = state.GetMoves()
+        while moves != [] and produced < count:
+            yield state.Clone()
+            produced += 1
+            state.DoMove(rng.choice(moves))
+            moves = state.GetMoves()
+
+def CompletedPositions(path, itermax, seed):
+    """ Return the set of position ids already written to the output file at path.
+        Raise ValueError if the file holds results from other search settings.
+    """
+    done = set()
+    try:
+        with open(path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    pid = record["id"]
+                except (ValueError, KeyError):
+                    # A partially written line from an interrupted run
+                    continue
+                if record.get("itermax") != itermax or record.get("seed") != seed:
+                    raise ValueError(str(path) + " holds results for itermax " + str(record.get("itermax"))
+                                     + " and seed " + str(record.get("seed")) + ", not " + str(itermax)
+                                     + " and " + str(seed))
+                done.add(pid)
+    except FileNotFoundError:
+        pass
+    return done
+
+def DropPartialLine(path):
+    """ Truncate a partially written last line left by an interrupted run, so the
+        next record appended to the file starts on a line of its own.
+    """
+    try:
+        with open(path, "r+b") as f:
+            f.seek(0, 2)
+            end = f.tell()
+            pos = end
+            while pos > 0:
+                step = min(4096, pos)
+                f.seek(pos - step)
+                chunk = f.read(step)
+                nl = chunk.rfind(b"\n")
+                if nl >= 0:
+                    pos = pos - step + nl + 1
+                    break
+                pos -= step
+            if pos != end:
+                f.truncate(pos)
+    except FileNotFoundError:
+        pass
+
+def AnalysePosition(job):
+    """ Run UCT on a single position and return its result record.
+    """
+    pid, state, itermax, seed = job
+    # A stream per position keeps results independent of the number of workers
+    rootnode = UCTSearch(state, itermax, rng = RandomStream(DeriveSeed(seed, pid)))
+    children = []
+    for c in sorted(rootnode.childNodes, key = lambda c: -c.visits):
+        children.append({"move": pp(c.move), "visits": c.visits, "value": c.wins / c.visits})
+    record = {"id": pid, "itermax": itermax, "seed": seed, "children": children, "best": None}
+    if children:
+        record["best"] = children[0]["move"]
+    return record
+
+def AnalysePositions(inpath, outpath, itermax = 1000, workers = None, seed = 0):
+    """ Analyse every position in inpath that is not yet in outpath.
+        Results are appended to outpath one JSON line per position as they complete.
+        Return the number of positions analysed in this run.
+    """
+    decktournement.PRINTS = False
+    workers = workers or multiprocessing.cpu_count()
+    DropPartialLine(outpath)
+    done = CompletedPositions(outpath, itermax, seed)
+    jobs = ((pid, state, itermax, seed) for pid, state in ReadPositions(inpath) if pid not in done)
+    analysed = 0
+
+    with multiprocessing.Pool(workers) as pool, open(outpath, "a") as out:
+        while True:
+            # Only hand the pool a bounded batch at a time so the input stays streamed
+            batch = list(itertools.islice(jobs, workers * BATCH_PER_WORKER))
+            if not batch:
+                break
+            for record in pool.imap_unordered(AnalysePosition, batch):
+                out.write(json.dumps(record) + "\n")
+                out.flush()
+                analysed += 1
+
+    return analysed
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 3 and sys.argv[1] == "generate":
+        count = int(sys.argv[3]) if len(sys.argv) > 3 else 1000
+        seed = int(sys.argv[4]) if len(sys.argv) > 4 else 2
+        WritePositions(sys.argv[2], SamplePositions(count, seed))
+    elif len(sys.argv) >= 4 and sys.argv[1] == "analyse":
+        itermax = int(sys.argv[4]) if len(sys.argv) > 4 else 1000
+        workers = int(sys.argv[5]) if len(sys.argv) > 5 else None
+        n = AnalysePositions(sys.argv[2], sys.argv[3], itermax, workers)
+        print("Analysed " + str(n) + " positions")
+    else:
+        print("usage: positionanalysis.py generate positions.pkl [count] [seed]")
+        print("       positionanalysis.py analyse positions.pkl results.jsonl [itermax] [workers]")